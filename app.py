@@ -1,17 +1,32 @@
+from __future__ import annotations
+
 import io
 import datetime as dt
+from typing import TYPE_CHECKING
+from xml.sax.saxutils import escape
 
 import streamlit as st
 import pandas as pd
-import altair as alt
-
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import numpy as np
+
+from charts import ca_chart_spec, comp_chart_spec, gap_chart_spec
+from core import (
+    compute_year,
+    fmt_eur_vec,
+    fmt_pct_vec,
+    hash_arrays,
+    hours_arrays,
+    hours_frame,
+)
 
+# python-docx et reportlab.pdfgen sont importés dans les fonctions d'export :
+# le premier affichage de la page ne paie pas leur coût d'import.
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
-from reportlab.pdfgen import canvas
+
+if TYPE_CHECKING:
+    from docx import Document
+    from reportlab.pdfgen import canvas
 
 st.set_page_config(
     page_title="Rapprochement CA / Achats / Heures – Bâtiment",
@@ -19,127 +34,115 @@ st.set_page_config(
 )
 
 # =========================
-# Utils
+# Excel (trame + import)
 # =========================
-def fmt_eur(x):
-    try:
-        return f"{float(x):,.0f} €".replace(",", " ")
-    except Exception:
-        return ""
-
-def fmt_pct(x):
-    try:
-        return f"{float(x) * 100:.1f} %"
-    except Exception:
-        return ""
-
-def safe_div(a, b):
-    return a / b if b not in (0, None) else 0.0
-
-def normalize_hours_df(df: pd.DataFrame) -> pd.DataFrame:
-    """Normalise la table des heures (types + colonne heures facturables)."""
-    if df is None or df.empty:
-        df = pd.DataFrame([{"Personne": "", "Heures": 0.0, "Coef_production": 0.0}])
-
-    out = df.copy()
-    for col in ["Personne", "Heures", "Coef_production"]:
-        if col not in out.columns:
-            out[col] = "" if col == "Personne" else 0.0
-
-    out["Personne"] = out["Personne"].astype(str).fillna("")
-    out["Heures"] = pd.to_numeric(out["Heures"], errors="coerce").fillna(0.0)
-    out["Coef_production"] = pd.to_numeric(out["Coef_production"], errors="coerce").fillna(0.0)
-
-    out["Heures_facturables"] = out["Heures"] * out["Coef_production"]
-    return out[["Personne", "Heures", "Coef_production", "Heures_facturables"]]
-
-def compute_year(ca, achats, df_hours, taux_horaire, coef_refact):
-    ca = float(ca or 0.0)
-    achats = float(achats or 0.0)
-    taux_horaire = float(taux_horaire or 0.0)
-    coef_refact = float(coef_refact or 0.0)
-
-    marge = ca - achats
-    tx_marge = safe_div(marge, ca) if ca else 0.0
-
-    dfh = normalize_hours_df(df_hours)
-    heures = float(dfh["Heures"].sum())
-    heures_fact = float(dfh["Heures_facturables"].sum())
-
-    ca_theo_achats = achats * coef_refact
-    ca_theo_heures = heures_fact * taux_horaire
-    ca_theo_total = ca_theo_achats + ca_theo_heures
-
-    ecart = ca - ca_theo_total
-    ecart_pct = safe_div(ecart, ca) if ca else 0.0
+REQUIRED_COLS = ["Personne", "Heures", "Coef_production"]
 
+@st.cache_resource
+def template_hours() -> dict[str, pd.DataFrame]:
+    """Tables d'exemple de la trame (onglets N et N-1), construites une fois par process. Lecture seule."""
     return {
-        "marge": marge,
-        "tx_marge": tx_marge,
-        "dfh": dfh,
-        "heures": heures,
-        "heures_fact": heures_fact,
-        "ca_theo_achats": ca_theo_achats,
-        "ca_theo_heures": ca_theo_heures,
-        "ca_theo_total": ca_theo_total,
-        "ecart": ecart,
-        "ecart_pct": ecart_pct,
+        "N": pd.DataFrame(
+            [
+                {"Personne": "Ouvrier 1", "Heures": 140, "Coef_production": 0.75},
+                {"Personne": "Ouvrier 2", "Heures": 152, "Coef_production": 0.70},
+            ],
+            columns=REQUIRED_COLS
+        ),
+        "N-1": pd.DataFrame(
+            [
+                {"Personne": "Ouvrier 1", "Heures": 138, "Coef_production": 0.72},
+                {"Personne": "Ouvrier 2", "Heures": 150, "Coef_production": 0.68},
+            ],
+            columns=REQUIRED_COLS
+        ),
     }
 
-# =========================
-# Excel (trame + import)
-# =========================
-REQUIRED_COLS = ["Personne", "Heures", "Coef_production"]
+@st.cache_resource
+def default_hours() -> dict[str, pd.DataFrame]:
+    """Tables d'heures initiales de la session (N et N-1), construites une fois par process. Lecture seule.
+
+    Colonnes en dtypes Arrow : st.data_editor les sérialise sans conversion, y compris après ajout de lignes
+    complètes (Heures s'élargit en int64[pyarrow]). Les colonnes laissées vides dans une ligne ajoutée
+    repassent en object ; hours_arrays coerce alors ces seules colonnes.
+    """
+    def hours_table(heures: list[int], coefs: list[float]) -> pd.DataFrame:
+        return pd.DataFrame({
+            "Personne": pd.array(["Ouvrier 1", "Ouvrier 2"], dtype="string[pyarrow]"),
+            "Heures": pd.array(heures, dtype="int32[pyarrow]"),
+            # float64 (et non float32) : 0.70 resterait 0.699999988 dans les calculs
+            "Coef_production": pd.array(coefs, dtype="float64[pyarrow]"),
+        })
+
+    return {
+        "N": hours_table([140, 140], [0.75, 0.70]),
+        "N-1": hours_table([140, 140], [0.70, 0.68]),
+    }
 
+# Configuration des colonnes des deux éditeurs d'heures : construite une fois par process
+# (data_editor en fait une copie profonde, l'objet partagé n'est jamais modifié)
+@st.cache_resource
+def hours_column_config() -> dict:
+    return {
+        "Personne": st.column_config.TextColumn(required=True),
+        "Heures": st.column_config.NumberColumn(min_value=0.0, step=1.0),
+        "Coef_production": st.column_config.NumberColumn(min_value=0.0, max_value=2.0, step=0.01, format="%.2f"),
+    }
+
+@st.cache_resource  # bytes immuables : partagés tels quels, sans copie (dé-pickling) à chaque rerun
 def make_template_excel_bytes() -> bytes:
     """Génère une trame Excel (2 onglets N et N-1) en mémoire."""
-    df_n = pd.DataFrame(
-        [
-            {"Personne": "Ouvrier 1", "Heures": 140, "Coef_production": 0.75},
-            {"Personne": "Ouvrier 2", "Heures": 152, "Coef_production": 0.70},
-        ],
-        columns=REQUIRED_COLS
-    )
-    df_n1 = pd.DataFrame(
-        [
-            {"Personne": "Ouvrier 1", "Heures": 138, "Coef_production": 0.72},
-            {"Personne": "Ouvrier 2", "Heures": 150, "Coef_production": 0.68},
-        ],
-        columns=REQUIRED_COLS
-    )
-
+    # Appelée au clic sur le bouton de téléchargement (data=callable) : xlsxwriter
+    # n'est importé (par pandas) qu'à ce moment-là.
     buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        df_n.to_excel(writer, index=False, sheet_name="N")
-        df_n1.to_excel(writer, index=False, sheet_name="N-1")
+    # xlsxwriter : écriture directe, sans le modèle objet complet d'openpyxl.
+    # (pas de constant_memory : pandas n'écrit pas les cellules ligne par ligne)
+    # in_memory : le zip est assemblé en mémoire, sans fichiers temporaires sur disque.
+    with pd.ExcelWriter(buf, engine="xlsxwriter", engine_kwargs={"options": {"in_memory": True}}) as writer:
+        for sheet_name, df in template_hours().items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
     return buf.getvalue()
 
 def read_hours_sheet(xls: pd.ExcelFile, sheet_name: str):
     if sheet_name not in xls.sheet_names:
         return None
-    df = pd.read_excel(xls, sheet_name=sheet_name)
+    # Seules les 3 colonnes attendues sont lues (en-têtes comparés sans espaces) ; Personne en texte
+    # directement. Heures / Coef_production restent inférées : les cellules invalides sont mises à 0
+    # plus loin au lieu de faire échouer l'import.
+    df = pd.read_excel(
+        xls,
+        sheet_name=sheet_name,
+        usecols=lambda c: str(c).strip() in REQUIRED_COLS,
+        dtype={"Personne": "string"},
+    )
     df.columns = [str(c).strip() for c in df.columns]
     missing = set(REQUIRED_COLS) - set(df.columns)
     if missing:
         raise ValueError(f"Onglet '{sheet_name}' : colonnes manquantes: {', '.join(sorted(missing))}")
-    return df[REQUIRED_COLS].copy()
+    return df[REQUIRED_COLS]  # la sélection de colonnes renvoie déjà un nouveau DataFrame
 
 def load_hours_from_excel(uploaded_file):
     """Attend un xlsx avec onglet N (obligatoire) + onglet N-1 (optionnel)."""
-    xls = pd.ExcelFile(uploaded_file)
+    xls = pd.ExcelFile(uploaded_file, engine="calamine")
     df_n = read_hours_sheet(xls, "N")
     if df_n is None:
         raise ValueError("L'onglet 'N' est obligatoire.")
     df_n1 = read_hours_sheet(xls, "N-1")
     return df_n, df_n1
 
+# Clé = contenu du fichier : un second clic (ou un rerun) sur le même xlsx ne le re-parse pas
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_hours_from_excel_bytes(file_bytes: bytes):
+    return load_hours_from_excel(io.BytesIO(file_bytes))
+
 # =========================
 # Export Word / PDF
 # =========================
 def build_summary_payload(
     use_n1: bool,
-    ca_n: float, achats_n: float, taux_horaire_n: float, coef_refact_n: float, res_n: dict,
-    ca_n1: float | None, achats_n1: float | None, taux_horaire_n1: float | None, coef_refact_n1: float | None, res_n1: dict | None,
+    ca_n: float, achats_n: float, taux_horaire_n: float, coef_refact_n: float, res_n: dict, hours_n: tuple,
+    ca_n1: float | None, achats_n1: float | None, taux_horaire_n1: float | None, coef_refact_n1: float | None,
+    res_n1: dict | None, hours_n1: tuple | None,
 ):
     """Structure stable pour exporter (Word/PDF)."""
     payload = {
@@ -150,6 +153,7 @@ def build_summary_payload(
             "taux_horaire": taux_horaire_n,
             "coef_refact": coef_refact_n,
             "res": res_n,
+            "hours": hours_n,
         },
         "N-1": None,
         "use_n1": bool(use_n1 and res_n1 is not None),
@@ -161,9 +165,74 @@ def build_summary_payload(
             "taux_horaire": taux_horaire_n1,
             "coef_refact": coef_refact_n1,
             "res": res_n1,
+            "hours": hours_n1,
         }
     return payload
 
+def export_key(payload: dict) -> tuple:
+    """Clé légère identifiant le contenu d'un payload (sans sérialiser les rapports)."""
+    def block_key(block: dict | None):
+        if block is None:
+            return None
+        return (
+            block["ca"], block["achats"], block["taux_horaire"], block["coef_refact"],
+            hash_arrays(*block["hours"]),
+        )
+
+    return payload["date"], payload["use_n1"], block_key(payload["N"]), block_key(payload["N-1"])
+
+def format_hours_columns(dfh: pd.DataFrame):
+    """Colonnes de la table des heures formatées en une passe (Personne, Heures, Coef, Heures fact.)."""
+    persons = dfh["Personne"].astype(str).to_numpy()
+    formatted = [
+        np.char.mod("%.2f", pd.to_numeric(dfh[col], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64))
+        for col in ["Heures", "Coef_production", "Heures_facturables"]
+    ]
+    return persons, *formatted
+
+def summary_lines(block: dict) -> list[tuple[str, str]]:
+    """Lignes « Données & résultats » d'une année (communes au Word et au PDF)."""
+    res = block["res"]
+    eur = fmt_eur_vec([
+        block["ca"], block["achats"], res["marge"],
+        res["ca_theo_achats"], res["ca_theo_heures"], res["ca_theo_total"], res["ecart"],
+    ]).tolist()
+    pct = fmt_pct_vec([res["tx_marge"], res["ecart_pct"]]).tolist()
+    return [
+        ("Chiffre d'affaires (réel)", eur[0]),
+        ("Achats", eur[1]),
+        ("Marge (CA - Achats)", eur[2]),
+        ("Taux de marge", pct[0]),
+        ("Heures totales", f"{res['heures']:.2f} h"),
+        ("Heures facturables", f"{res['heures_fact']:.2f} h"),
+        ("CA théorique achats", eur[3]),
+        ("CA théorique heures", eur[4]),
+        ("CA théorique total", eur[5]),
+        ("Écart (réel - théorique)", eur[6]),
+        ("Écart (%)", pct[1]),
+    ]
+
+def docx_append_rows(table, rows):
+    """Ajoute toutes les lignes au tableau via un seul fragment XML (au lieu d'un add_row() par ligne)."""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    tc_prs = [
+        f'<w:tcPr><w:tcW w:type="dxa" w:w="{gc.w.twips}"/></w:tcPr>' if gc.w is not None else ""
+        for gc in table._tbl.tblGrid.gridCol_lst
+    ]
+    trs = "".join(
+        "<w:tr>"
+        + "".join(
+            f'<w:tc>{tc_pr}<w:p><w:r><w:t xml:space="preserve">{escape(str(v))}</w:t></w:r></w:p></w:tc>'
+            for tc_pr, v in zip(tc_prs, row)
+        )
+        + "</w:tr>"
+        for row in rows
+    )
+    fragment = parse_xml(f'<w:tbl {nsdecls("w")}>{trs}</w:tbl>')
+    table._tbl.extend(list(fragment))
+
 def add_docx_kv_table(doc: Document, title: str, rows: list[tuple[str, str]]):
     doc.add_heading(title, level=2)
     table = doc.add_table(rows=1, cols=2)
@@ -171,17 +240,11 @@ def add_docx_kv_table(doc: Document, title: str, rows: list[tuple[str, str]]):
     hdr[0].text = "Indicateur"
     hdr[1].text = "Valeur"
 
-    for k, v in rows:
-        r = table.add_row().cells
-        r[0].text = str(k)
-        r[1].text = str(v)
+    docx_append_rows(table, rows)
 
 def add_docx_hours_table(doc: Document, title: str, dfh: pd.DataFrame):
     doc.add_heading(title, level=2)
-    df_show = dfh.copy()
-    # arrondis propres
-    for col in ["Heures", "Coef_production", "Heures_facturables"]:
-        df_show[col] = pd.to_numeric(df_show[col], errors="coerce").fillna(0.0)
+    persons, heures, coefs, heures_fact = format_hours_columns(dfh)
 
     table = doc.add_table(rows=1, cols=4)
     hdr = table.rows[0].cells
@@ -190,14 +253,15 @@ def add_docx_hours_table(doc: Document, title: str, dfh: pd.DataFrame):
     hdr[2].text = "Coef production"
     hdr[3].text = "Heures facturables"
 
-    for _, row in df_show.iterrows():
-        r = table.add_row().cells
-        r[0].text = str(row.get("Personne", ""))
-        r[1].text = f"{float(row.get('Heures', 0.0)):.2f}"
-        r[2].text = f"{float(row.get('Coef_production', 0.0)):.2f}"
-        r[3].text = f"{float(row.get('Heures_facturables', 0.0)):.2f}"
+    docx_append_rows(table, zip(persons, heures, coefs, heures_fact))
 
+# Rapports partagés entre sessions pour un même payload ; borné : les octets restent en mémoire du process
+@st.cache_data(show_spinner=False, max_entries=16)
 def generate_docx_report(payload: dict) -> bytes:
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
     doc = Document()
 
     # Style simple
@@ -213,7 +277,6 @@ def generate_docx_report(payload: dict) -> bytes:
     doc.add_paragraph(" ")
 
     def section_for(label: str, block: dict):
-        res = block["res"]
         doc.add_heading(f"Année {label}", level=1)
 
         add_docx_kv_table(
@@ -225,25 +288,9 @@ def generate_docx_report(payload: dict) -> bytes:
             ],
         )
 
-        add_docx_kv_table(
-            doc,
-            "Données & résultats",
-            [
-                ("Chiffre d'affaires (réel)", fmt_eur(block["ca"])),
-                ("Achats", fmt_eur(block["achats"])),
-                ("Marge (CA - Achats)", fmt_eur(res["marge"])),
-                ("Taux de marge", fmt_pct(res["tx_marge"])),
-                ("Heures totales", f"{res['heures']:.2f} h"),
-                ("Heures facturables", f"{res['heures_fact']:.2f} h"),
-                ("CA théorique achats", fmt_eur(res["ca_theo_achats"])),
-                ("CA théorique heures", fmt_eur(res["ca_theo_heures"])),
-                ("CA théorique total", fmt_eur(res["ca_theo_total"])),
-                ("Écart (réel - théorique)", fmt_eur(res["ecart"])),
-                ("Écart (%)", fmt_pct(res["ecart_pct"])),
-            ],
-        )
+        add_docx_kv_table(doc, "Données & résultats", summary_lines(block))
 
-        add_docx_hours_table(doc, "Détail heures par personne", res["dfh"])
+        add_docx_hours_table(doc, "Détail heures par personne", hours_frame(*block["hours"]))
         doc.add_page_break()
 
     section_for("N", payload["N"])
@@ -256,13 +303,24 @@ def generate_docx_report(payload: dict) -> bytes:
     doc.save(out)
     return out.getvalue()
 
-def pdf_draw_kv(c: canvas.Canvas, x: float, y: float, key: str, val: str, key_w: float = 7.0*cm):
+def pdf_draw_kv_rows(c: canvas.Canvas, x: float, y: float, rows: list[tuple[str, str]],
+                     key_w: float = 7.0*cm, step: float = 0.5*cm) -> float:
+    """Dessine des lignes clé / valeur (un seul changement de police par colonne). Renvoie le y suivant."""
+    ys = [y - i * step for i in range(len(rows))]
     c.setFont("Helvetica", 10)
-    c.drawString(x, y, key)
+    for yi, (key, _) in zip(ys, rows):
+        c.drawString(x, yi, key)
     c.setFont("Helvetica-Bold", 10)
-    c.drawString(x + key_w, y, val)
+    for yi, (_, val) in zip(ys, rows):
+        c.drawString(x + key_w, yi, val)
+    return y - len(rows) * step
+
+def pdf_draw_table_hours(c: canvas.Canvas, x: float, y: float, cols: tuple, start: int = 0, max_rows: int = 28):
+    """Dessine au plus `max_rows` lignes de la table des heures à partir de la ligne `start`.
 
-def pdf_draw_table_hours(c: canvas.Canvas, x: float, y: float, dfh: pd.DataFrame, max_rows: int = 28):
+    `cols` : colonnes déjà formatées (cf. format_hours_columns).
+    Renvoie (y, indice de la prochaine ligne à dessiner).
+    """
     # Header
     c.setFont("Helvetica-Bold", 10)
     c.drawString(x, y, "Personne")
@@ -275,24 +333,25 @@ def pdf_draw_table_hours(c: canvas.Canvas, x: float, y: float, dfh: pd.DataFrame
     y -= 0.35*cm
 
     c.setFont("Helvetica", 9)
-    df_show = dfh.copy()
-    for col in ["Heures", "Coef_production", "Heures_facturables"]:
-        df_show[col] = pd.to_numeric(df_show[col], errors="coerce").fillna(0.0)
-
-    rows = 0
-    for _, r in df_show.iterrows():
-        if rows >= max_rows:
-            return y, True  # overflow
-        c.drawString(x, y, str(r.get("Personne", ""))[:45])
-        c.drawRightString(x + 10.3*cm, y, f"{float(r.get('Heures', 0.0)):.2f}")
-        c.drawRightString(x + 12.6*cm, y, f"{float(r.get('Coef_production', 0.0)):.2f}")
-        c.drawRightString(x + 17.8*cm, y, f"{float(r.get('Heures_facturables', 0.0)):.2f}")
-        y -= 0.45*cm
-        rows += 1
-
-    return y, False
-
+    persons, heures, coefs, heures_fact = cols
+    stop = min(len(persons), start + max_rows)
+    n = stop - start
+
+    # ordonnées de toutes les lignes de la page calculées d'un coup
+    ys = (y - np.arange(n) * (0.45*cm)).tolist()
+    x_h, x_c, x_hf = x + 10.3*cm, x + 12.6*cm, x + 17.8*cm
+    for yi, p, h, coef, hf in zip(ys, persons[start:stop], heures[start:stop], coefs[start:stop], heures_fact[start:stop]):
+        c.drawString(x, yi, p)
+        c.drawRightString(x_h, yi, h)
+        c.drawRightString(x_c, yi, coef)
+        c.drawRightString(x_hf, yi, hf)
+
+    return y - n * 0.45*cm, stop
+
+@st.cache_data(show_spinner=False, max_entries=16)
 def generate_pdf_report(payload: dict) -> bytes:
+    from reportlab.pdfgen import canvas
+
     buf = io.BytesIO()
     c = canvas.Canvas(buf, pagesize=A4)
     width, height = A4
@@ -308,7 +367,6 @@ def generate_pdf_report(payload: dict) -> bytes:
         c.showPage()
 
     def year_page(label: str, block: dict):
-        res = block["res"]
         x = 2.0*cm
         y = height - 2.3*cm
 
@@ -320,46 +378,36 @@ def generate_pdf_report(payload: dict) -> bytes:
         c.drawString(x, y, "Paramètres")
         y -= 0.6*cm
 
-        pdf_draw_kv(c, x, y, "Taux horaire", f"{block['taux_horaire']:.2f} €/h"); y -= 0.5*cm
-        pdf_draw_kv(c, x, y, "Coef refacturation achats", f"{block['coef_refact']:.2f}"); y -= 0.8*cm
+        y = pdf_draw_kv_rows(c, x, y, [
+            ("Taux horaire", f"{block['taux_horaire']:.2f} €/h"),
+            ("Coef refacturation achats", f"{block['coef_refact']:.2f}"),
+        ])
+        y -= 0.3*cm
 
         c.setFont("Helvetica-Bold", 12)
         c.drawString(x, y, "Données & résultats")
         y -= 0.6*cm
 
-        lines = [
-            ("Chiffre d'affaires (réel)", fmt_eur(block["ca"])),
-            ("Achats", fmt_eur(block["achats"])),
-            ("Marge (CA - Achats)", fmt_eur(res["marge"])),
-            ("Taux de marge", fmt_pct(res["tx_marge"])),
-            ("Heures totales", f"{res['heures']:.2f} h"),
-            ("Heures facturables", f"{res['heures_fact']:.2f} h"),
-            ("CA théorique achats", fmt_eur(res["ca_theo_achats"])),
-            ("CA théorique heures", fmt_eur(res["ca_theo_heures"])),
-            ("CA théorique total", fmt_eur(res["ca_theo_total"])),
-            ("Écart (réel - théorique)", fmt_eur(res["ecart"])),
-            ("Écart (%)", fmt_pct(res["ecart_pct"])),
-        ]
-        for k, v in lines:
-            pdf_draw_kv(c, x, y, k, v)
-            y -= 0.5*cm
+        y = pdf_draw_kv_rows(c, x, y, summary_lines(block))
 
         y -= 0.2*cm
         c.setFont("Helvetica-Bold", 12)
         c.drawString(x, y, "Détail heures par personne")
         y -= 0.7*cm
 
-        # Table hours, multi-pages if needed
-        overflow = True
-        dfh = res["dfh"]
-        while overflow:
-            y, overflow = pdf_draw_table_hours(c, x, y, dfh, max_rows=28)
-            if overflow:
-                c.showPage()
-                y = height - 2.3*cm
-                c.setFont("Helvetica-Bold", 12)
-                c.drawString(x, y, f"Année {label} — Détail heures (suite)")
-                y -= 0.9*cm
+        # Table hours, multi-pages if needed (colonnes formatées une seule fois)
+        persons, heures, coefs, heures_fact = format_hours_columns(hours_frame(*block["hours"]))
+        cols = (persons.astype("U45").tolist(), heures.tolist(), coefs.tolist(), heures_fact.tolist())
+        start = 0
+        while True:
+            y, start = pdf_draw_table_hours(c, x, y, cols, start=start, max_rows=28)
+            if start >= len(persons):
+                break
+            c.showPage()
+            y = height - 2.3*cm
+            c.setFont("Helvetica-Bold", 12)
+            c.drawString(x, y, f"Année {label} — Détail heures (suite)")
+            y -= 0.9*cm
 
         c.showPage()
 
@@ -375,22 +423,10 @@ def generate_pdf_report(payload: dict) -> bytes:
 # Default session state
 # =========================
 if "hours_n" not in st.session_state:
-    st.session_state["hours_n"] = pd.DataFrame(
-        [
-            {"Personne": "Ouvrier 1", "Heures": 140, "Coef_production": 0.75},
-            {"Personne": "Ouvrier 2", "Heures": 140, "Coef_production": 0.70},
-        ],
-        columns=REQUIRED_COLS
-    )
+    st.session_state["hours_n"] = default_hours()["N"].copy()
 
 if "hours_n1" not in st.session_state:
-    st.session_state["hours_n1"] = pd.DataFrame(
-        [
-            {"Personne": "Ouvrier 1", "Heures": 140, "Coef_production": 0.70},
-            {"Personne": "Ouvrier 2", "Heures": 140, "Coef_production": 0.68},
-        ],
-        columns=REQUIRED_COLS
-    )
+    st.session_state["hours_n1"] = default_hours()["N-1"].copy()
 
 # =========================
 # UI
@@ -426,13 +462,13 @@ left, right = st.columns([1, 1])
 
 with left:
     st.markdown("### Télécharger une trame Excel")
-    template_bytes = make_template_excel_bytes()
     st.download_button(
         label="📄 Télécharger la trame (.xlsx)",
-        data=template_bytes,
+        data=make_template_excel_bytes,
         file_name="trame_heures_batiment.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        use_container_width=True,
+        on_click="ignore",  # téléchargement sans rerun du script
+        width="stretch",
     )
     st.caption("Trame avec 2 onglets : **N** et **N-1** (colonnes : Personne, Heures, Coef_production).")
 
@@ -446,12 +482,13 @@ with right:
 
     col_btn1, col_btn2 = st.columns([1, 1])
     with col_btn1:
-        if uploaded is not None and st.button("🔄 Charger depuis l'Excel", use_container_width=True):
+        if uploaded is not None and st.button("🔄 Charger depuis l'Excel", width="stretch"):
             try:
-                df_n, df_n1 = load_hours_from_excel(uploaded)
-                st.session_state["hours_n"] = df_n.copy()
+                # st.cache_data renvoie déjà des copies propres à cet appel : pas de .copy() supplémentaire
+                df_n, df_n1 = load_hours_from_excel_bytes(uploaded.getvalue())
+                st.session_state["hours_n"] = df_n
                 if df_n1 is not None:
-                    st.session_state["hours_n1"] = df_n1.copy()
+                    st.session_state["hours_n1"] = df_n1
                 st.success("Import OK ✅ Tableaux rechargés. Tu peux ensuite modifier manuellement.")
             except Exception as e:
                 st.error(f"Import impossible : {e}")
@@ -459,94 +496,92 @@ with right:
     with col_btn2:
         with st.expander("Aperçu trame (exemple)"):
             st.write("**Onglet N** / **Onglet N-1** : mêmes colonnes")
-            st.dataframe(
-                pd.DataFrame(
-                    [
-                        {"Personne": "Ouvrier 1", "Heures": 140, "Coef_production": 0.75},
-                        {"Personne": "Ouvrier 2", "Heures": 152, "Coef_production": 0.70},
-                    ],
-                    columns=REQUIRED_COLS
-                ),
-                use_container_width=True
-            )
+            st.dataframe(template_hours()["N"], width="stretch")
 
 st.divider()
 
+# Saisies (sections 1 et 2) regroupées dans un formulaire : les modifications sont
+# mises en attente et un seul rerun (calculs, KPI, graphiques) a lieu au clic sur « Calculer ».
+# Les paramètres de la barre latérale (dont l'activation de N-1) restent immédiats.
+inputs_form = st.form("inputs", border=False)
+
 # =========================
 # 1) CA / Achats
 # =========================
-st.subheader("1️⃣ Chiffre d’affaires et achats")
-
-c1, c2 = st.columns(2)
-
-with c1:
-    st.markdown("### Année N")
-    ca_n = st.number_input("CA N", min_value=0.0, value=300000.0, step=1000.0)
-    achats_n = st.number_input("Achats N", min_value=0.0, value=150000.0, step=1000.0)
-
-with c2:
-    st.markdown("### Année N-1")
-    if use_n1:
-        ca_n1 = st.number_input("CA N-1", min_value=0.0, value=280000.0, step=1000.0)
-        achats_n1 = st.number_input("Achats N-1", min_value=0.0, value=140000.0, step=1000.0)
-    else:
-        ca_n1 = None
-        achats_n1 = None
-        st.info("N-1 désactivé")
+with inputs_form:
+    st.subheader("1️⃣ Chiffre d’affaires et achats")
+
+    c1, c2 = st.columns(2)
+
+    with c1:
+        st.markdown("### Année N")
+        ca_n = st.number_input("CA N", min_value=0.0, value=300000.0, step=1000.0)
+        achats_n = st.number_input("Achats N", min_value=0.0, value=150000.0, step=1000.0)
+
+    with c2:
+        st.markdown("### Année N-1")
+        if use_n1:
+            ca_n1 = st.number_input("CA N-1", min_value=0.0, value=280000.0, step=1000.0)
+            achats_n1 = st.number_input("Achats N-1", min_value=0.0, value=140000.0, step=1000.0)
+        else:
+            ca_n1 = None
+            achats_n1 = None
+            st.info("N-1 désactivé")
 
-st.divider()
+    st.divider()
 
 # =========================
 # 2) Heures – Edition manuelle
 # =========================
-st.subheader("2️⃣ Heures par personne (modifiable manuellement)")
-
-h1, h2 = st.columns(2)
-
-with h1:
-    st.markdown("### Ouvriers – N")
-    st.session_state["hours_n"] = st.data_editor(
-        st.session_state["hours_n"],
-        num_rows="dynamic",
-        use_container_width=True,
-        key="editor_hours_n",
-        column_config={
-            "Personne": st.column_config.TextColumn(required=True),
-            "Heures": st.column_config.NumberColumn(min_value=0.0, step=1.0),
-            "Coef_production": st.column_config.NumberColumn(min_value=0.0, max_value=2.0, step=0.01, format="%.2f"),
-        },
-    )
+with inputs_form:
+    st.subheader("2️⃣ Heures par personne (modifiable manuellement)")
 
-with h2:
-    st.markdown("### Ouvriers – N-1")
-    if use_n1:
-        if st.button("Copier le tableau N → N-1", use_container_width=True):
-            st.session_state["hours_n1"] = st.session_state["hours_n"].copy()
+    h1, h2 = st.columns(2)
 
-        st.session_state["hours_n1"] = st.data_editor(
-            st.session_state["hours_n1"],
+    with h1:
+        st.markdown("### Ouvriers – N")
+        st.session_state["hours_n"] = st.data_editor(
+            st.session_state["hours_n"],
             num_rows="dynamic",
-            use_container_width=True,
-            key="editor_hours_n1",
-            column_config={
-                "Personne": st.column_config.TextColumn(required=True),
-                "Heures": st.column_config.NumberColumn(min_value=0.0, step=1.0),
-                "Coef_production": st.column_config.NumberColumn(min_value=0.0, max_value=2.0, step=0.01, format="%.2f"),
-            },
+            width="stretch",
+            key="editor_hours_n",
+            column_config=hours_column_config(),
         )
-    else:
-        st.info("N-1 désactivé")
 
-st.caption("Heures facturables = Heures × Coef de production.")
+    with h2:
+        st.markdown("### Ouvriers – N-1")
+        if use_n1:
+            st.session_state["hours_n1"] = st.data_editor(
+                st.session_state["hours_n1"],
+                num_rows="dynamic",
+                width="stretch",
+                key="editor_hours_n1",
+                column_config=hours_column_config(),
+            )
+        else:
+            st.info("N-1 désactivé")
+
+    st.caption("Heures facturables = Heures × Coef de production.")
+    st.form_submit_button("🧮 Calculer", type="primary", width="stretch")
+
+# Hors formulaire (un st.button n'y est pas autorisé) : copie immédiate de la table N validée
+if use_n1 and st.button("Copier le tableau N → N-1", width="stretch"):
+    st.session_state["hours_n1"] = st.session_state["hours_n"].copy()
+    st.rerun()
+
 st.divider()
 
 # =========================
 # 3) Calculs
 # =========================
-res_n = compute_year(ca_n, achats_n, st.session_state["hours_n"], taux_horaire_n, coef_refact_n)
+# Tables de l'éditeur converties une seule fois en tableaux (calculs, export et détail les partagent)
+hours_n = hours_arrays(st.session_state["hours_n"])
+res_n = compute_year(ca_n, achats_n, hours_n[1], hours_n[2], taux_horaire_n, coef_refact_n)
+hours_n1 = None
 res_n1 = None
 if use_n1 and ca_n1 is not None and achats_n1 is not None:
-    res_n1 = compute_year(ca_n1, achats_n1, st.session_state["hours_n1"], taux_horaire_n1, coef_refact_n1)
+    hours_n1 = hours_arrays(st.session_state["hours_n1"])
+    res_n1 = compute_year(ca_n1, achats_n1, hours_n1[1], hours_n1[2], taux_horaire_n1, coef_refact_n1)
 
 # =========================
 # 3) KPI
@@ -554,137 +589,45 @@ if use_n1 and ca_n1 is not None and achats_n1 is not None:
 st.subheader("3️⃣ Résultats")
 
 k1, k2, k3, k4 = st.columns(4)
-k1.metric("Marge N", fmt_eur(res_n["marge"]), fmt_pct(res_n["tx_marge"]))
-k2.metric("Heures facturables N", f"{res_n['heures_fact']:.1f} h")
-k3.metric("CA théorique N", fmt_eur(res_n["ca_theo_total"]))
-k4.metric("Écart N (réel − théorique)", fmt_eur(res_n["ecart"]), fmt_pct(res_n["ecart_pct"]))
+k1.metric("Marge N", res_n["marge_str"], res_n["tx_marge_str"])
+k2.metric("Heures facturables N", res_n["heures_fact_str"])
+k3.metric("CA théorique N", res_n["ca_theo_total_str"])
+k4.metric("Écart N (réel − théorique)", res_n["ecart_str"], res_n["ecart_pct_str"])
 
 if res_n1 is not None:
     st.divider()
     k1b, k2b, k3b, k4b = st.columns(4)
-    k1b.metric("Marge N-1", fmt_eur(res_n1["marge"]), fmt_pct(res_n1["tx_marge"]))
-    k2b.metric("Heures facturables N-1", f"{res_n1['heures_fact']:.1f} h")
-    k3b.metric("CA théorique N-1", fmt_eur(res_n1["ca_theo_total"]))
-    k4b.metric("Écart N-1 (réel − théorique)", fmt_eur(res_n1["ecart"]), fmt_pct(res_n1["ecart_pct"]))
+    k1b.metric("Marge N-1", res_n1["marge_str"], res_n1["tx_marge_str"])
+    k2b.metric("Heures facturables N-1", res_n1["heures_fact_str"])
+    k3b.metric("CA théorique N-1", res_n1["ca_theo_total_str"])
+    k4b.metric("Écart N-1 (réel − théorique)", res_n1["ecart_str"], res_n1["ecart_pct_str"])
 
 st.divider()
 
 # =========================
-# 4) Graphiques (Altair)
+# 4) Graphiques (Vega-Lite)
 # =========================
 st.subheader("4️⃣ Analyse graphique")
 
-rows = [
-    {"Année": "N", "Type": "CA réel", "Montant": float(ca_n)},
-    {"Année": "N", "Type": "CA théorique", "Montant": float(res_n["ca_theo_total"])},
-]
-if res_n1 is not None:
-    rows += [
-        {"Année": "N-1", "Type": "CA réel", "Montant": float(ca_n1)},
-        {"Année": "N-1", "Type": "CA théorique", "Montant": float(res_n1["ca_theo_total"])},
-    ]
-df_compare = pd.DataFrame(rows)
-
-chart_ca = (
-    alt.Chart(df_compare)
-    .mark_bar()
-    .encode(
-        x=alt.X("Année:N", title="Année"),
-        xOffset=alt.XOffset("Type:N"),
-        y=alt.Y("Montant:Q", title="Montant (€)"),
-        color=alt.Color("Type:N", legend=alt.Legend(title="")),
-        tooltip=[alt.Tooltip("Année:N"), alt.Tooltip("Type:N"), alt.Tooltip("Montant:Q", format=",.0f")],
-    )
-)
-
-labels_ca = (
-    alt.Chart(df_compare)
-    .mark_text(dy=-8)
-    .encode(
-        x=alt.X("Année:N"),
-        xOffset=alt.XOffset("Type:N"),
-        y=alt.Y("Montant:Q"),
-        detail="Type:N",
-        text=alt.Text("Montant:Q", format=",.0f"),
-    )
-)
-
-gap_rows = [{"Année": "N", "Écart": float(res_n["ecart"])}]
-if res_n1 is not None:
-    gap_rows.append({"Année": "N-1", "Écart": float(res_n1["ecart"])})
-df_gap = pd.DataFrame(gap_rows)
-
-gap_bar = (
-    alt.Chart(df_gap)
-    .mark_bar()
-    .encode(
-        x=alt.X("Année:N", title="Année"),
-        y=alt.Y("Écart:Q", title="Écart (€)"),
-        color=alt.condition(
-            alt.datum["Écart"] >= 0,
-            alt.value("#2e7d32"),
-            alt.value("#c62828"),
-        ),
-        tooltip=[alt.Tooltip("Année:N"), alt.Tooltip("Écart:Q", format=",.0f")],
-    )
-)
-
-gap_zero = alt.Chart(pd.DataFrame({"y": [0]})).mark_rule().encode(y="y:Q")
-
-gap_labels = (
-    alt.Chart(df_gap)
-    .mark_text(dy=-8)
-    .encode(
-        x="Année:N",
-        y="Écart:Q",
-        text=alt.Text("Écart:Q", format=",.0f"),
-    )
-)
-
-comp_rows = [
-    {"Année": "N", "Composant": "Achats / revente", "Montant": float(res_n["ca_theo_achats"])},
-    {"Année": "N", "Composant": "Heures", "Montant": float(res_n["ca_theo_heures"])},
-]
+years = [("N", ca_n, res_n)]
 if res_n1 is not None:
-    comp_rows += [
-        {"Année": "N-1", "Composant": "Achats / revente", "Montant": float(res_n1["ca_theo_achats"])},
-        {"Année": "N-1", "Composant": "Heures", "Montant": float(res_n1["ca_theo_heures"])},
-    ]
-df_comp = pd.DataFrame(comp_rows)
-
-chart_comp = (
-    alt.Chart(df_comp)
-    .mark_bar()
-    .encode(
-        x=alt.X("Année:N", title="Année"),
-        y=alt.Y("sum(Montant):Q", title="CA théorique (€)"),
-        color=alt.Color("Composant:N", legend=alt.Legend(title="")),
-        tooltip=[alt.Tooltip("Année:N"), alt.Tooltip("Composant:N"), alt.Tooltip("Montant:Q", format=",.0f")],
-    )
-)
+    years.append(("N-1", ca_n1, res_n1))
 
-labels_comp = (
-    alt.Chart(df_comp)
-    .mark_text(color="white")
-    .encode(
-        x="Année:N",
-        y=alt.Y("Montant:Q", stack="zero"),
-        detail="Composant:N",
-        text=alt.Text("Montant:Q", format=",.0f"),
-    )
-)
+spec_ca = ca_chart_spec([(a, ca, r["ca_theo_total"]) for a, ca, r in years])
+spec_gap = gap_chart_spec([(a, r["ecart"]) for a, _, r in years])
+spec_comp = comp_chart_spec([(a, r["ca_theo_achats"], r["ca_theo_heures"]) for a, _, r in years])
 
 colA, colB = st.columns(2)
 with colA:
     st.markdown("### CA réel vs CA théorique")
-    st.altair_chart((chart_ca + labels_ca).properties(height=340), use_container_width=True)
+    st.vega_lite_chart(spec_ca, width="stretch")
 
 with colB:
     st.markdown("### Écart (réel − théorique)")
-    st.altair_chart((gap_bar + gap_zero + gap_labels).properties(height=340), use_container_width=True)
+    st.vega_lite_chart(spec_gap, width="stretch")
 
 st.markdown("### Composition du CA théorique")
-st.altair_chart((chart_comp + labels_comp).properties(height=360), use_container_width=True)
+st.vega_lite_chart(spec_comp, width="stretch")
 
 # =========================
 # 5) Export Word / PDF
@@ -694,35 +637,60 @@ st.subheader("5️⃣ Export récap (Word / PDF)")
 
 payload = build_summary_payload(
     use_n1=use_n1,
-    ca_n=ca_n, achats_n=achats_n, taux_horaire_n=taux_horaire_n, coef_refact_n=coef_refact_n, res_n=res_n,
-    ca_n1=ca_n1, achats_n1=achats_n1, taux_horaire_n1=taux_horaire_n1, coef_refact_n1=coef_refact_n1, res_n1=res_n1,
+    ca_n=ca_n, achats_n=achats_n, taux_horaire_n=taux_horaire_n, coef_refact_n=coef_refact_n,
+    res_n=res_n, hours_n=hours_n,
+    ca_n1=ca_n1, achats_n1=achats_n1, taux_horaire_n1=taux_horaire_n1, coef_refact_n1=coef_refact_n1,
+    res_n1=res_n1, hours_n1=hours_n1,
 )
 
-colW, colP = st.columns(2)
+# Fragment : « Préparer l'export » ne relance que ce bloc (ni calculs, ni KPI, ni graphiques) ;
+# les téléchargements (on_click="ignore") ne relancent rien.
+@st.fragment
+def export_block(payload: dict):
+    # Génération à la demande : python-docx / reportlab ne tournent pas à chaque rerun,
+    # et jamais deux fois pour la même empreinte de données.
+    current_key = export_key(payload)
+    export = st.session_state.get("export")
+    up_to_date = export is not None and export["key"] == current_key
+
+    if st.button("⚙️ Préparer l'export", width="stretch", disabled=up_to_date):
+        export = st.session_state["export"] = {
+            "key": current_key,
+            "docx": generate_docx_report(payload),
+            "pdf": generate_pdf_report(payload),
+        }
+        up_to_date = True
 
-with colW:
-    docx_bytes = generate_docx_report(payload)
-    st.download_button(
-        "📝 Télécharger le récap Word (.docx)",
-        data=docx_bytes,
-        file_name=f"recap_ca_achats_heures_{dt.date.today().strftime('%Y%m%d')}.docx",
-        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        use_container_width=True,
-    )
+    if not up_to_date:
+        st.info("Cliquer sur « Préparer l'export » pour générer les récaps Word et PDF à partir des données actuelles.")
+    else:
+        colW, colP = st.columns(2)
+
+        with colW:
+            st.download_button(
+                "📝 Télécharger le récap Word (.docx)",
+                data=export["docx"],
+                file_name=f"recap_ca_achats_heures_{dt.date.today().strftime('%Y%m%d')}.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                on_click="ignore",
+                width="stretch",
+            )
 
-with colP:
-    pdf_bytes = generate_pdf_report(payload)
-    st.download_button(
-        "🧾 Télécharger le récap PDF",
-        data=pdf_bytes,
-        file_name=f"recap_ca_achats_heures_{dt.date.today().strftime('%Y%m%d')}.pdf",
-        mime="application/pdf",
-        use_container_width=True,
-    )
+        with colP:
+            st.download_button(
+                "🧾 Télécharger le récap PDF",
+                data=export["pdf"],
+                file_name=f"recap_ca_achats_heures_{dt.date.today().strftime('%Y%m%d')}.pdf",
+                mime="application/pdf",
+                on_click="ignore",
+                width="stretch",
+            )
+
+export_block(payload)
 
 with st.expander("Détails des heures (avec heures facturables)"):
     st.markdown("#### N")
-    st.dataframe(res_n["dfh"], use_container_width=True)
+    st.dataframe(hours_frame(*hours_n), width="stretch")
     if res_n1 is not None:
         st.markdown("#### N-1")
-        st.dataframe(res_n1["dfh"], use_container_width=True)
+        st.dataframe(hours_frame(*hours_n1), width="stretch")
@@ -0,0 +1,93 @@
+"""Specs Vega-Lite des graphiques, écrites directement (sans Altair).
+
+Les gabarits sont des constantes construites une seule fois à l'import du module ;
+à chaque rerun, seule la liste `data.values` (2 à 4 enregistrements) est assemblée.
+Ces dicts sont partagés : ne jamais les modifier en place.
+"""
+from __future__ import annotations
+
+FMT_EUR = ",.0f"
+
+def nominal(field: str) -> dict:
+    return {"field": field, "type": "nominal"}
+
+def quantitative(field: str, **extra) -> dict:
+    return {"field": field, "type": "quantitative", **extra}
+
+def bars_with_labels(base: dict, bar: dict, text_mark: dict, text: dict) -> list[dict]:
+    """Couches barres + étiquettes partageant le même encodage de base (x / xOffset / y).
+
+    `bar` et `text` ne portent que les canaux propres à chaque couche (couleur, tooltip / texte, detail).
+    """
+    return [
+        {"mark": {"type": "bar"}, "encoding": {**base, **bar}},
+        {"mark": text_mark, "encoding": {**base, **text}},
+    ]
+
+X_YEAR = {**nominal("Année"), "title": "Année"}
+MONTANT_TEXT = quantitative("Montant", format=FMT_EUR)
+
+CA_SPEC = {
+    "height": 340,
+    "layer": bars_with_labels(
+        base={"x": X_YEAR, "xOffset": nominal("Type"), "y": quantitative("Montant", title="Montant (€)")},
+        bar={
+            "color": {**nominal("Type"), "legend": {"title": ""}},
+            "tooltip": [nominal("Année"), nominal("Type"), MONTANT_TEXT],
+        },
+        text_mark={"type": "text", "dy": -8},
+        text={"detail": nominal("Type"), "text": MONTANT_TEXT},
+    ),
+}
+
+ECART_TEXT = quantitative("Écart", format=FMT_EUR)
+GAP_SPEC = {
+    "height": 340,
+    "layer": bars_with_labels(
+        base={"x": X_YEAR, "y": quantitative("Écart", title="Écart (€)")},
+        bar={
+            "color": {"condition": {"test": "datum['Écart'] >= 0", "value": "#2e7d32"}, "value": "#c62828"},
+            "tooltip": [nominal("Année"), ECART_TEXT],
+        },
+        text_mark={"type": "text", "dy": -8},
+        text={"text": ECART_TEXT},
+    ),
+}
+# ligne du zéro, entre les barres et les étiquettes : données propres à la couche
+GAP_SPEC["layer"].insert(1, {"data": {"values": [{"y": 0}]}, "mark": {"type": "rule"}, "encoding": {"y": quantitative("y")}})
+
+COMP_SPEC = {
+    "height": 360,
+    "layer": bars_with_labels(
+        base={"x": X_YEAR, "y": quantitative("Montant", stack="zero", title="CA théorique (€)")},
+        bar={
+            "color": {**nominal("Composant"), "legend": {"title": ""}},
+            "tooltip": [nominal("Année"), nominal("Composant"), MONTANT_TEXT],
+        },
+        text_mark={"type": "text", "color": "white"},
+        text={"detail": nominal("Composant"), "text": MONTANT_TEXT},
+    ),
+}
+
+def year_pairs_values(rows, col: str, labels: tuple[str, str]) -> list[dict]:
+    """(Année, v1, v2) par année -> enregistrements au format long, 2 par année (Année / `col` / Montant)."""
+    return [
+        {"Année": r[0], col: label, "Montant": float(v)}
+        for r in rows
+        for label, v in zip(labels, r[1:])
+    ]
+
+def ca_chart_spec(rows) -> dict:
+    """CA réel vs CA théorique. rows = ((Année, CA réel, CA théorique), ...)."""
+    return {**CA_SPEC, "data": {"values": year_pairs_values(rows, "Type", ("CA réel", "CA théorique"))}}
+
+def gap_chart_spec(rows) -> dict:
+    """Écart réel - théorique. rows = ((Année, Écart), ...)."""
+    return {**GAP_SPEC, "data": {"values": [{"Année": r[0], "Écart": float(r[1])} for r in rows]}}
+
+def comp_chart_spec(rows) -> dict:
+    """Composition du CA théorique. rows = ((Année, achats refacturés, heures facturées), ...).
+
+    Un seul montant par (Année, Composant) : déjà agrégé, les barres sont simplement empilées.
+    """
+    return {**COMP_SPEC, "data": {"values": year_pairs_values(rows, "Composant", ("Achats / revente", "Heures"))}}
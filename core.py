@@ -0,0 +1,162 @@
+"""Calculs et formats partagés par l'application (sans widget Streamlit).
+
+Importé une seule fois par process : les reruns du script ne redéfinissent pas ces fonctions.
+"""
+from __future__ import annotations
+
+import math
+import hashlib
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba est optionnel : sans lui, les totaux d'heures passent par NumPy
+    njit = None
+
+# =========================
+# Utils
+# =========================
+# Nombres acceptés par fmt_eur / fmt_pct (bool inclus via int) ; le reste (None, texte...) -> ""
+REAL_TYPES = (int, float, np.integer, np.floating)
+
+def fmt_eur(x):
+    if not isinstance(x, REAL_TYPES) or not math.isfinite(x):
+        return ""
+    return f"{x:,.0f} €".replace(",", " ")
+
+def fmt_pct(x):
+    if not isinstance(x, REAL_TYPES) or not math.isfinite(x):
+        return ""
+    return f"{x * 100:.1f} %"
+
+def fmt_eur_vec(values) -> np.ndarray:
+    """Version vectorisée de fmt_eur (même rendu, espaces entre milliers), en une passe NumPy."""
+    v = np.rint(np.asarray(values, dtype=np.float64))
+    finite = np.isfinite(v)
+    n = np.abs(np.where(finite, v, 0.0)).astype(np.int64)
+    out = np.where(np.signbit(v), "-", "")
+
+    # groupes de 3 chiffres, du plus fort au plus faible
+    scale = 1
+    while (n >= scale * 1000).any():
+        scale *= 1000
+    while scale >= 1:
+        grp = (n // scale) % 1000
+        piece = np.where(n < scale * 1000, np.char.mod("%d", grp), np.char.mod(" %03d", grp))
+        out = np.char.add(out, np.where((n >= scale) | (scale == 1), piece, ""))
+        scale //= 1000
+    return np.where(finite, np.char.add(out, " €"), "")
+
+def fmt_pct_vec(values) -> np.ndarray:
+    """Version vectorisée de fmt_pct."""
+    v = np.asarray(values, dtype=np.float64) * 100
+    return np.where(np.isfinite(v), np.char.mod("%.1f %%", v), "")
+
+def hash_arrays(*arrays: np.ndarray) -> bytes:
+    """Empreinte courte du contenu de tableaux NumPy (dtypes non objet), pour les clés d'export."""
+    h = hashlib.blake2b(digest_size=8)
+    for a in arrays:
+        h.update(f"{a.dtype}{a.shape}".encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.digest()
+
+def hours_arrays(df: pd.DataFrame | None):
+    """Table des heures de l'éditeur -> tableaux NumPy (noms, heures, coefs ; valeurs invalides -> 0).
+
+    Extraits une fois par rerun puis partagés par les calculs, l'export et l'affichage.
+    Les noms sont en dtype str (et non objet) pour être hachés sur leur contenu.
+    """
+    n = 0 if df is None else len(df)
+
+    def numeric(col: str) -> np.ndarray:
+        if n == 0 or col not in df.columns:
+            return np.zeros(n)
+        s = df[col]
+        if pd.api.types.is_numeric_dtype(s.dtype):
+            # cas courant (éditeur déjà numérique) : conversion directe + NaN -> 0 en place, sans to_numeric
+            a = s.to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+            return np.nan_to_num(a, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+        return pd.to_numeric(s, errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+
+    if n and "Personne" in df.columns:
+        personne = df["Personne"].astype(str).fillna("").to_numpy(dtype=str)
+    else:
+        personne = np.full(n, "")
+    return personne, numeric("Heures"), numeric("Coef_production")
+
+def hours_frame(personne: np.ndarray, heures: np.ndarray, coef: np.ndarray) -> pd.DataFrame:
+    """Table des heures normalisée (avec heures facturables) pour l'affichage et les exports."""
+    if len(heures) == 0:
+        personne, heures, coef = np.full(1, ""), np.zeros(1), np.zeros(1)
+
+    return pd.DataFrame({
+        "Personne": pd.Categorical(personne),  # noms répétés (N / N-1) : codes entiers plutôt qu'objets str
+        "Heures": heures,
+        "Coef_production": coef,
+        "Heures_facturables": heures * coef,
+    })
+
+if njit is not None:
+    # core est un module importé une seule fois par process : la compilation numba
+    # est faite au premier appel puis relue depuis le cache disque aux redémarrages.
+    # fastmath limité à la réassociation / FMA (vectorisation de la somme) : pas d'hypothèse
+    # "nnan" / "ninf", hours_arrays conservant volontairement les ±inf.
+    @njit(cache=True, fastmath={"reassoc", "contract"})
+    def hours_sums(heures, coefs):
+        """(total heures, total heures facturables) en une seule boucle compilée."""
+        s1 = 0.0
+        s2 = 0.0
+        for i in range(heures.size):
+            s1 += heures[i]
+            s2 += heures[i] * coefs[i]
+        return s1, s2
+else:
+    def hours_sums(heures, coefs):
+        """(total heures, total heures facturables) ; produit scalaire BLAS sans tableau intermédiaire."""
+        return heures.sum(), np.dot(heures, coefs)
+
+YEAR_KEYS = (
+    "marge", "tx_marge", "heures", "heures_fact",
+    "ca_theo_achats", "ca_theo_heures", "ca_theo_total", "ecart", "ecart_pct",
+)
+
+def year_kernel(heures, coefs, ca, achats, taux_horaire, coef_refact):
+    """Noyau numérique d'une année : tableaux float64 (heures, coefs) + scalaires -> tuple de floats (ordre YEAR_KEYS)."""
+    h_sum, hf_sum = hours_sums(heures, coefs)
+    marge = ca - achats
+    ca_theo_achats = achats * coef_refact
+    ca_theo_heures = hf_sum * taux_horaire
+    ca_theo_total = ca_theo_achats + ca_theo_heures
+    ecart = ca - ca_theo_total
+    tx_marge = marge / ca if ca != 0.0 else 0.0
+    ecart_pct = ecart / ca if ca != 0.0 else 0.0
+    return marge, tx_marge, h_sum, hf_sum, ca_theo_achats, ca_theo_heures, ca_theo_total, ecart, ecart_pct
+
+if njit is not None:
+    # tout le calcul d'une année en un seul appel compilé (hours_sums est appelé sans repasser par Python)
+    year_kernel = njit(cache=True)(year_kernel)
+
+# Une entrée par combinaison (montants, paramètres, heures) : borné pour ne pas croître à chaque saisie
+@st.cache_data(show_spinner=False, max_entries=256)
+def compute_year(ca, achats, heures: np.ndarray, coefs: np.ndarray, taux_horaire, coef_refact):
+    ca = float(ca or 0.0)
+    achats = float(achats or 0.0)
+    taux_horaire = float(taux_horaire or 0.0)
+    coef_refact = float(coef_refact or 0.0)
+
+    values = year_kernel(heures, coefs, ca, achats, taux_horaire, coef_refact)
+    res = {k: float(v) for k, v in zip(YEAR_KEYS, values)}
+
+    # Libellés des KPI formatés ici : produits une fois par jeu d'entrées, puis servis par le cache
+    res.update({
+        "marge_str": fmt_eur(res["marge"]),
+        "tx_marge_str": fmt_pct(res["tx_marge"]),
+        "heures_fact_str": f"{res['heures_fact']:.1f} h",
+        "ca_theo_total_str": fmt_eur(res["ca_theo_total"]),
+        "ecart_str": fmt_eur(res["ecart"]),
+        "ecart_pct_str": fmt_pct(res["ecart_pct"]),
+    })
+    return res